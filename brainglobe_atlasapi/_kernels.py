@@ -0,0 +1,55 @@
+"""Numba-compiled kernels for bulk queries on the atlas stacks.
+
+Importing this module requires numba: callers are expected to catch the
+ImportError and fall back to the equivalent numpy implementation.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, cache=True)
+def lookup(
+    coords,
+    resolution,
+    annotation,
+    hemispheres,
+    ids,
+    ancestors,
+    depths,
+    use_level,
+    level,
+):
+    """Fused structure and hemisphere lookup for an (N, 3) array of points.
+
+    Points falling outside the stacks get structure and hemisphere 0. If
+    use_level is true, each structure is replaced by its ancestor at that
+    hierarchy level, counted from the leaf if negative (0 if the structure
+    does not reach that level).
+    """
+    n_points = coords.shape[0]
+    out_rid = np.zeros(n_points, dtype=annotation.dtype)
+    out_hem = np.zeros(n_points, dtype=hemispheres.dtype)
+    nx, ny, nz = annotation.shape
+
+    for i in prange(n_points):
+        ix = int(coords[i, 0] / resolution[0])
+        iy = int(coords[i, 1] / resolution[1])
+        iz = int(coords[i, 2] / resolution[2])
+        if not (0 <= ix < nx and 0 <= iy < ny and 0 <= iz < nz):
+            continue
+
+        rid = annotation[ix, iy, iz]
+        if use_level:
+            row = np.searchsorted(ids, rid)
+            if row < ids.shape[0] and ids[row] == rid:
+                depth = depths[row]
+                col = level if level >= 0 else depth + level
+                rid = ancestors[row, col] if 0 <= col < depth else 0
+            else:
+                rid = 0
+
+        out_rid[i] = rid
+        out_hem[i] = hemispheres[ix, iy, iz]
+
+    return out_rid, out_hem
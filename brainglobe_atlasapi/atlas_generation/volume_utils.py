@@ -42,7 +42,13 @@ def create_masked_array(volume, label, greater_than=False):
         if not isinstance(label, list):
             arr[volume == label] = 1
         else:
-            arr[np.isin(volume, label)] = 1
+            # Compare in the volume dtype, to avoid upcasting the whole
+            # volume when the labels fit in it:
+            labels = np.asarray(label)
+            labels_cast = labels.astype(volume.dtype)
+            if np.array_equal(labels_cast, labels):
+                labels = labels_cast
+            arr[np.isin(volume, labels)] = 1
     else:
         arr[volume > label] = 1
     return arr
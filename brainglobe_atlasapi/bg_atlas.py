@@ -42,6 +42,14 @@ class BrainGlobeAtlas(core.Atlas):
     fn_update : Callable
         Handler function to update during download. Takes completed and total
         bytes.
+    zarr_backend : bool (optional)
+        If true, read the atlas stacks from chunked zarr copies, creating
+        them next to the tiff files on first access. The stacks are then
+        zarr.Array objects instead of numpy arrays (default=False).
+    prefetch : bool (optional)
+        If true, start opening the annotation and reference stacks in a
+        background thread after instantiation. With zarr_backend, stacks
+        without a zarr copy yet are not prefetched (default=True).
 
     """
 
@@ -56,6 +64,8 @@ class BrainGlobeAtlas(core.Atlas):
         check_latest=True,
         config_dir=None,
         fn_update=None,
+        zarr_backend=False,
+        prefetch=True,
     ):
         self.atlas_name = atlas_name
         self.fn_update = fn_update
@@ -89,7 +99,11 @@ class BrainGlobeAtlas(core.Atlas):
             self.download_extract_file()
 
         # Instantiate after eventual download:
-        super().__init__(self.brainglobe_dir / self.local_full_name)
+        super().__init__(
+            self.brainglobe_dir / self.local_full_name,
+            zarr_backend=zarr_backend,
+            prefetch=prefetch,
+        )
 
         if check_latest:
             self.check_latest_version()
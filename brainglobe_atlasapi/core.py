@@ -1,5 +1,7 @@
+import threading
 import warnings
 from collections import UserDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -7,19 +9,40 @@ import pandas as pd
 from brainglobe_space import AnatomicalSpace
 
 from brainglobe_atlasapi.descriptors import (
+    ANNOTATION_DTYPE,
     ANNOTATION_FILENAME,
     HEMISPHERES_FILENAME,
     MESHES_DIRNAME,
     METADATA_FILENAME,
     REFERENCE_FILENAME,
     STRUCTURES_FILENAME,
+    ZARR_CHUNKS,
+    ZARR_SUFFIX,
 )
 from brainglobe_atlasapi.structure_class import StructuresDict
-from brainglobe_atlasapi.utils import read_json, read_tiff, get_leaves_from_tree
+from brainglobe_atlasapi.structure_tree_util import (
+    get_ancestors_table,
+    get_descendants_map,
+)
+from brainglobe_atlasapi.utils import (
+    get_leaves_from_tree,
+    memmap_tiff,
+    read_json,
+    read_tiff,
+    tiff_to_zarr,
+)
 
 LEFT_HEMI_VAL = 1
 RIGHT_HEMI_VAL = 2
 
+# Approximate size in bytes of the annotation slabs processed at once when
+# building structure masks, chosen to keep each slab cache-resident:
+MASK_BLOCK_BYTES = 512 * 1024
+
+# Largest id range covered by the lookup table used to build structure
+# masks; structures whose descendant ids span more use a binary search:
+MASK_LUT_MAX_SIZE = 2**24
+
 
 class Atlas:
     """Base class to handle atlases in BrainGlobe.
@@ -28,25 +51,61 @@ class Atlas:
     ----------
     path : str or Path object
         Path to folder containing data info.
+    zarr_backend : bool (optional)
+        If true, read the atlas stacks from chunked zarr copies stored next
+        to the tiff files, creating them on first access if needed. This
+        requires zarr to be installed. The reference, annotation and
+        hemispheres stacks are then zarr.Array objects rather than numpy
+        arrays: use [:] to load them in memory for numpy operations such as
+        comparisons or reductions (default=False).
+    prefetch : bool (optional)
+        If true, start opening the annotation and reference stacks in a
+        background thread as soon as the atlas is instantiated. With
+        zarr_backend, stacks without a zarr copy yet are not prefetched:
+        their copy is created on first access (default=True).
     """
 
-    def __init__(self, path):
+    def __init__(self, path, zarr_backend=False, prefetch=True):
         self.root_dir = Path(path)
+        self.zarr_backend = zarr_backend
         self.metadata = read_json(self.root_dir / METADATA_FILENAME)
 
+        # Make metadata entries more accessible from class, as plain
+        # attributes since they are read in the hot coordinate-query paths:
+        self.resolution = tuple(self.metadata["resolution"])
+        self.orientation = self.metadata["orientation"]
+        self.shape = tuple(self.metadata["shape"])
+        self.shape_um = tuple(
+            [s * r for s, r in zip(self.shape, self.resolution)]
+        )
+
         # Load structures list:
         structures_list = read_json(self.root_dir / STRUCTURES_FILENAME)
         # keep to generate tree and dataframe views when necessary
         self.structures_list = structures_list
 
-        # Add entry for file paths:
+        # Add entry for file paths (joining strings, as chaining Path
+        # operations for every structure is slow for large atlases):
+        meshes_dir = str(self.root_dir / MESHES_DIRNAME)
         for struct in structures_list:
-            struct["mesh_filename"] = (
-                self.root_dir / MESHES_DIRNAME / "{}.obj".format(struct["id"])
-            )
+            struct["mesh_filename"] = Path(f"{meshes_dir}/{struct['id']}.obj")
 
         self.structures = StructuresDict(structures_list)
 
+        # Cache the ids of all descendants, and the ids and acronyms of all
+        # ancestors of each structure:
+        self._descendants = get_descendants_map(structures_list)
+        self._id_paths = {
+            s["id"]: s["structure_id_path"] for s in structures_list
+        }
+        id_to_acronym = {s["id"]: s["acronym"] for s in structures_list}
+        self._ancestor_acronyms = {
+            s["id"]: tuple(
+                id_to_acronym[a] for a in s["structure_id_path"][:-1]
+            )
+            for s in structures_list
+        }
+
         # Parse the structure list to find leaf nodes
         self.leaf_nodes = get_leaves_from_tree(self.structures_list)
 
@@ -75,26 +134,56 @@ class Atlas:
         self._annotation = None
         self._hemispheres = None
         self._lookup = None
+        self._ancestors_table = None
+
+        # Stacks can be loaded concurrently by the prefetching thread:
+        self._reference_lock = threading.Lock()
+        self._annotation_lock = threading.Lock()
+        self._prefetch_thread = None
+        if prefetch:
+            self._prefetch_thread = threading.Thread(
+                target=self._prefetch, daemon=True
+            )
+            self._prefetch_thread.start()
 
-    @property
-    def resolution(self):
-        """Make resolution more accessible from class."""
-        return tuple(self.metadata["resolution"])
-
-    @property
-    def orientation(self):
-        """Make orientation more accessible from class."""
-        return self.metadata["orientation"]
-
-    @property
-    def shape(self):
-        """Make shape more accessible from class."""
-        return tuple(self.metadata["shape"])
+    def _prefetch(self):
+        """Open the annotation and reference stacks ahead of their first use.
+        Errors are ignored here: they are raised again, to the caller, when
+        the stack is accessed.
+        """
+        for stack_name, filename in [
+            ("annotation", ANNOTATION_FILENAME),
+            ("reference", REFERENCE_FILENAME),
+        ]:
+            # Only prefetch stacks that open cheaply: creating a missing zarr
+            # copy writes to the atlas folder, and would be left incomplete
+            # if the interpreter exited during the (daemon) prefetch:
+            zarr_path = (self.root_dir / filename).with_suffix(ZARR_SUFFIX)
+            if self.zarr_backend and not zarr_path.exists():
+                continue
 
-    @property
-    def shape_um(self):
-        """Make shape more accessible from class."""
-        return tuple([s * r for s, r in zip(self.shape, self.resolution)])
+            try:
+                getattr(self, stack_name)
+            except Exception:
+                pass
+
+    def __getstate__(self):
+        # Locks and threads cannot be pickled or copied; stacks that are
+        # still being prefetched are loaded by the copy on first access:
+        state = self.__dict__.copy()
+        for name in [
+            "_reference_lock",
+            "_annotation_lock",
+            "_prefetch_thread",
+        ]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reference_lock = threading.Lock()
+        self._annotation_lock = threading.Lock()
+        self._prefetch_thread = None
 
     @property
     def hierarchy(self):
@@ -105,25 +194,42 @@ class Atlas:
     def lookup_df(self):
         """Returns a dataframe with id, acronym and name for each structure."""
         if self._lookup is None:
+            # Arrow-backed strings are much more compact than object columns:
             self._lookup = pd.DataFrame(
                 dict(
-                    acronym=[r["acronym"] for r in self.structures_list],
-                    id=[r["id"] for r in self.structures_list],
-                    name=[r["name"] for r in self.structures_list],
+                    acronym=pd.array(
+                        [r["acronym"] for r in self.structures_list],
+                        dtype="string[pyarrow]",
+                    ),
+                    id=np.fromiter(
+                        (r["id"] for r in self.structures_list),
+                        dtype=ANNOTATION_DTYPE,
+                        count=len(self.structures_list),
+                    ),
+                    name=pd.array(
+                        [r["name"] for r in self.structures_list],
+                        dtype="string[pyarrow]",
+                    ),
                 )
             )
         return self._lookup
 
     @property
     def reference(self):
+        # Check again under the lock, in case the prefetching thread is
+        # loading it; once loaded, access does not need the lock:
         if self._reference is None:
-            self._reference = read_tiff(self.root_dir / REFERENCE_FILENAME)
+            with self._reference_lock:
+                if self._reference is None:
+                    self._reference = self._load_volume(REFERENCE_FILENAME)
         return self._reference
 
     @property
     def annotation(self):
         if self._annotation is None:
-            self._annotation = read_tiff(self.root_dir / ANNOTATION_FILENAME)
+            with self._annotation_lock:
+                if self._annotation is None:
+                    self._annotation = self._load_volume(ANNOTATION_FILENAME)
         return self._annotation
 
     @property
@@ -131,26 +237,46 @@ class Atlas:
         if self._hemispheres is None:
             # If reference is symmetric generate hemispheres block:
             if self.metadata["symmetric"]:
-                # initialize empty stack:
-                stack = np.full(self.metadata["shape"], 2, dtype=np.uint8)
+                # No need to fill, every voxel is written exactly once below:
+                stack = np.empty(self.metadata["shape"], dtype=np.uint8)
 
                 # Use bgspace description to fill out with hemisphere values:
                 front_ax_idx = self.space.axes_order.index("frontal")
+                midline = stack.shape[front_ax_idx] // 2 + 1
 
-                # Fill out with 2s the right hemisphere:
-                slices = [slice(None) for _ in range(3)]
-                slices[front_ax_idx] = slice(
-                    stack.shape[front_ax_idx] // 2 + 1, None
-                )
-                stack[tuple(slices)] = 1
+                right_slices = [slice(None) for _ in range(3)]
+                right_slices[front_ax_idx] = slice(None, midline)
+                stack[tuple(right_slices)] = RIGHT_HEMI_VAL
+
+                left_slices = [slice(None) for _ in range(3)]
+                left_slices[front_ax_idx] = slice(midline, None)
+                stack[tuple(left_slices)] = LEFT_HEMI_VAL
 
                 self._hemispheres = stack
             else:
-                self._hemispheres = read_tiff(
-                    self.root_dir / HEMISPHERES_FILENAME
-                )
+                self._hemispheres = self._load_volume(HEMISPHERES_FILENAME)
         return self._hemispheres
 
+    def _load_volume(self, filename):
+        """Open one of the atlas stacks, from its zarr copy if zarr_backend
+        is set (creating it if needed), otherwise memory-mapping the tiff.
+        """
+        tiff_path = self.root_dir / filename
+        if not self.zarr_backend:
+            return memmap_tiff(tiff_path)
+
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError(
+                "zarr_backend=True requires zarr to be installed"
+            )
+
+        zarr_path = tiff_path.with_suffix(ZARR_SUFFIX)
+        if not zarr_path.exists():
+            tiff_to_zarr(tiff_path, zarr_path, chunks=ZARR_CHUNKS)
+        return zarr.open_array(str(zarr_path), mode="r")
+
     def hemisphere_from_coords(self, coords, microns=False, as_string=False):
         """Get the hemisphere from a coordinate triplet.
 
@@ -173,6 +299,8 @@ class Atlas:
         """
 
         hem = self.hemispheres[self._idx_from_coords(coords, microns)]
+        if self.zarr_backend:
+            hem = hem[()]  # unwrap the 0-d arrays returned by zarr
         if as_string:
             hem = ["left", "right"][hem - 1]
         return hem
@@ -207,10 +335,12 @@ class Atlas:
         """
 
         rid = self.annotation[self._idx_from_coords(coords, microns)]
+        if self.zarr_backend:
+            rid = rid[()]  # unwrap the 0-d arrays returned by zarr
 
         # If we want to cut the result at some high level of the hierarchy:
         if hierarchy_lev is not None:
-            rid = self.structures[rid]["structure_id_path"][hierarchy_lev]
+            rid = self._id_paths[rid][hierarchy_lev]
 
         if as_acronym:
             try:
@@ -221,6 +351,160 @@ class Atlas:
         else:
             return rid
 
+    def hemisphere_from_coords_batch(
+        self, coords, microns=False, as_string=False
+    ):
+        """Get the hemispheres from an array of coordinate triplets.
+
+        Parameters
+        ----------
+        coords : list or numpy array
+            (N, 3) array of coordinates. Default in voxels, can be microns if
+            microns=True
+        microns : bool
+            If true, coordinates are interpreted in microns.
+        as_string : bool
+            If true, returns "left" or "right" for each point.
+
+        Returns
+        -------
+        np.array
+            Array of N hemisphere labels.
+
+        """
+        hem = self.hemispheres[self._idx_from_coords_array(coords, microns)]
+        if as_string:
+            hem = np.array(["left", "right"])[hem - 1]
+        return hem
+
+    def structure_from_coords_batch(
+        self,
+        coords,
+        microns=False,
+        as_acronym=False,
+        hierarchy_lev=None,
+        key_error_string="Outside atlas",
+    ):
+        """Get the structures from an array of coordinate triplets.
+
+        Parameters
+        ----------
+        coords : list or numpy array
+            (N, 3) array of coordinates.
+        microns : bool
+            If true, coordinates are interpreted in microns.
+        as_acronym : bool
+            If true, the region acronyms are returned.
+            Points outside atlas get key_error_string.
+        hierarchy_lev : int or None
+            If specified, return parent node at thi hierarchy level.
+
+        Returns
+        -------
+        np.array
+            Array of N structure ids (or acronyms) containing the coordinates.
+        """
+        rids = self.annotation[self._idx_from_coords_array(coords, microns)]
+
+        # If we want to cut the result at some high level of the hierarchy,
+        # resolve each distinct id only once:
+        if hierarchy_lev is not None:
+            unique_rids, inverse = np.unique(rids, return_inverse=True)
+            parents = np.array(
+                [self._id_paths[rid][hierarchy_lev] for rid in unique_rids],
+                dtype=rids.dtype,
+            )
+            rids = parents[inverse.reshape(rids.shape)]
+
+        if as_acronym:
+            # Resolve each distinct id only once:
+            unique_rids, inverse = np.unique(rids, return_inverse=True)
+            structures = [self.structures.get(rid) for rid in unique_rids]
+            acronyms = np.array(
+                [
+                    key_error_string if s is None else s["acronym"]
+                    for s in structures
+                ],
+                dtype=object,
+            )
+            return acronyms[inverse.reshape(rids.shape)]
+        else:
+            return rids
+
+    def structure_and_hemisphere_from_coords_batch(
+        self, coords, microns=False, hierarchy_lev=None
+    ):
+        """Get both structures and hemispheres for an array of coordinate
+        triplets in a single pass. Meant for classifying large numbers of
+        points: if numba is installed, the lookup runs as a compiled
+        parallel loop.
+
+        Unlike the other from_coords methods, points outside the atlas
+        stacks do not raise an error and get structure and hemisphere 0.
+
+        Parameters
+        ----------
+        coords : list or numpy array
+            (N, 3) array of coordinates.
+        microns : bool
+            If true, coordinates are interpreted in microns.
+        hierarchy_lev : int or None
+            If specified, return parent node at this hierarchy level.
+            Negative levels are counted from the leaf, as in
+            structure_from_coords. Structures that do not reach that
+            level get 0 instead of raising an IndexError.
+
+        Returns
+        -------
+        tuple of np.array
+            Arrays of N structure ids and N hemisphere labels.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        resolution = np.asarray(
+            self.resolution if microns else (1.0, 1.0, 1.0), dtype=np.float64
+        )
+        ids, ancestors, depths = self._get_ancestors_table()
+
+        max_depth = ancestors.shape[1]
+        if hierarchy_lev is not None and not (
+            -max_depth <= hierarchy_lev < max_depth
+        ):
+            raise ValueError(
+                f"hierarchy_lev should be between {-max_depth} and "
+                f"{max_depth - 1}"
+            )
+
+        annotation, hemispheres = self.annotation, self.hemispheres
+        try:
+            from brainglobe_atlasapi._kernels import lookup
+        except ImportError:
+            lookup = _lookup_numpy
+
+        # The compiled kernel needs in-memory (or memory-mapped) arrays:
+        if not (
+            isinstance(annotation, np.ndarray)
+            and isinstance(hemispheres, np.ndarray)
+        ):
+            lookup = _lookup_numpy
+
+        return lookup(
+            coords,
+            resolution,
+            annotation,
+            hemispheres,
+            ids,
+            ancestors,
+            depths,
+            hierarchy_lev is not None,
+            hierarchy_lev or 0,
+        )
+
+    def _get_ancestors_table(self):
+        """Sorted structure ids and their ancestors, built on first use."""
+        if self._ancestors_table is None:
+            self._ancestors_table = get_ancestors_table(self.structures_list)
+        return self._ancestors_table
+
     # Meshes-related methods:
     def _get_from_structure(self, structure, key):
         """Internal interface to the structure dict. It support querying with a
@@ -239,10 +523,11 @@ class Atlas:
             If structure is a list, returns list.
 
         """
-        if isinstance(structure, list) or isinstance(structure, tuple):
-            return [self._get_from_structure(s, key) for s in structure]
+        get = self.structures.__getitem__
+        if isinstance(structure, (list, tuple)):
+            return [get(s)[key] for s in structure]
         else:
-            return self.structures[structure][key]
+            return get(structure)[key]
 
     def mesh_from_structure(self, structure):
         return self._get_from_structure(structure, "mesh")
@@ -259,9 +544,37 @@ class Atlas:
     def _idx_from_coords(self, coords, microns):
         # If microns are passed, convert:
         if microns:
-            coords = [c / res for c, res in zip(coords, self.resolution)]
+            r0, r1, r2 = self.resolution
+            return (
+                int(coords[0] / r0),
+                int(coords[1] / r1),
+                int(coords[2] / r2),
+            )
 
-        return tuple([int(c) for c in coords])
+        # Voxel coordinates that are already a tuple of ints can be used as
+        # they are (explicit checks, as a generator costs as much as int()):
+        if (
+            type(coords) is tuple
+            and len(coords) == 3
+            and type(coords[0]) is int
+            and type(coords[1]) is int
+            and type(coords[2]) is int
+        ):
+            return coords
+
+        return int(coords[0]), int(coords[1]), int(coords[2])
+
+    def _idx_from_coords_array(self, coords, microns):
+        """Convert an (N, 3) array of coordinates to a tuple of index arrays
+        that can be used to fancy-index the atlas stacks in one go.
+        """
+        coords = np.asarray(coords)
+        # If microns are passed, convert:
+        if microns:
+            coords = coords / np.asarray(self.resolution)
+
+        idx = coords.astype(np.intp)
+        return idx[:, 0], idx[:, 1], idx[:, 2]
 
     def get_structure_ancestors(self, structure):
         """Returns a list of acronyms for all ancestors of a given structure
@@ -277,11 +590,9 @@ class Atlas:
             List of descendants acronyms
 
         """
-        ancestors_id = self._get_from_structure(
-            structure, "structure_id_path"
-        )[:-1]
+        structure_id = self.structures[structure]["id"]
 
-        return self._get_from_structure(ancestors_id, "acronym")
+        return list(self._ancestor_acronyms[structure_id])
 
     def get_structure_descendants(self, structure):
         """Returns a list of acronyms for all descendants of a given structure.
@@ -297,17 +608,24 @@ class Atlas:
             List of descendants acronyms
 
         """
-        structure = self._get_from_structure(structure, "acronym")
+        structure_id = self.structures[structure]["id"]
+        descendant_ids = self._descendants[structure_id]
 
-        # For all structures check if given structure is ancestor
-        descendants = []
-        for struc in self.structures.keys():
-            if structure in self.get_structure_ancestors(struc):
-                descendants.append(self._get_from_structure(struc, "acronym"))
+        return [
+            s["acronym"]
+            for s in self.structures_list
+            if s["id"] in descendant_ids and s["id"] != structure_id
+        ]
 
-        return descendants
+    def _get_descendant_ids(self, structure):
+        """Ids of a structure and of all its descendants, from the cache
+        built at initialization.
+        """
+        return self._descendants[self.structures[structure]["id"]]
 
-    def get_structure_mask(self, structure, hemisphere=0):
+    def get_structure_mask(
+        self, structure, hemisphere=0, dtype=np.uint8, fill_value=1
+    ):
         """
         Returns a stack with the mask for a specific structure (including all
         sub-structures).
@@ -321,34 +639,137 @@ class Atlas:
             Structure id or acronym
         hemisphere : int, optional
             -1 left, 1 right, 0 both, by default = 0
+        dtype : numpy dtype, optional
+            dtype of the returned mask, by default np.uint8
+        fill_value : int, optional
+            Value of the voxels inside the structure, by default 1. For a
+            mask with the structure id as value, as returned by previous
+            versions, pass dtype=atlas.annotation.dtype and
+            fill_value=structure_id.
 
         Returns
         -------
         np.array
             stack containing the mask array.
         """
-        structure_id = self.structures[structure]["id"]
-        descendants = self.get_structure_descendants(structure)
+        descendant_ids = self._get_descendant_ids(structure)
+        descendant_ids = np.fromiter(
+            descendant_ids,
+            dtype=self.annotation.dtype,
+            count=len(descendant_ids),
+        )
 
-        descendant_ids = [
-            self.structures[descendant]["id"] for descendant in descendants
-        ]
-        descendant_ids.append(structure_id)
+        # Boolean lookup table indexed by annotation value (offset by the
+        # lowest descendant id), so the mask is obtained with a single gather
+        # over the annotation volume. Values below the lowest id wrap around
+        # to large unsigned offsets: all offsets are clamped, in unsigned
+        # space, onto the trailing False entry of the table:
+        descendant_ids = np.sort(descendant_ids)
+        lowest = descendant_ids[0]
+        span = int(descendant_ids[-1] - lowest) + 1
+        unsigned = f"u{descendant_ids.dtype.itemsize}"
+
+        if span <= MASK_LUT_MAX_SIZE:
+            lut = np.zeros(span + 1, dtype=bool)
+            lut[descendant_ids - lowest] = True
+
+            def is_descendant(values):
+                offsets = (values - lowest).view(unsigned)
+                np.minimum(offsets, span, out=offsets)
+                return lut[offsets]
 
-        mask_stack = np.zeros(self.shape, self.annotation.dtype)
-        mask_stack[np.isin(self.annotation, descendant_ids)] = structure_id
+        else:
+            # Ids too sparse for a table, use a binary search instead:
+            def is_descendant(values):
+                idx = np.searchsorted(descendant_ids, values)
+                idx = idx.clip(max=len(descendant_ids) - 1)
+                return descendant_ids[idx] == values
+
+        # Hemisphere value to exclude from the mask, if any:
+        if hemisphere == 0:
+            excluded_hemi = None
+        elif hemisphere == -1:
+            excluded_hemi = RIGHT_HEMI_VAL
+        elif hemisphere == 1:
+            excluded_hemi = LEFT_HEMI_VAL
+        else:
+            raise ValueError(
+                "Hemispheres parameter should be one of [-1, 0, 1]"
+            )
 
-        if not hemisphere == 0:
-            if hemisphere == -1:
-                mask_stack[self.hemispheres == RIGHT_HEMI_VAL] = 0
-            elif hemisphere == 1:
-                mask_stack[self.hemispheres == LEFT_HEMI_VAL] = 0
-            else:
-                raise ValueError('Hemispheres parameter should be one of [-1, 0, 1]')
+        # Process the volume in slabs along the first axis, writing each
+        # slab of the output in place in a single pass:
+        annotation = self.annotation
+        mask_stack = np.empty(self.shape, dtype)
+
+        def fill_slab(start):
+            slab = slice(start, start + block)
+            in_structure = is_descendant(annotation[slab])
+            if excluded_hemi is not None:
+                in_structure &= self.hemispheres[slab] != excluded_hemi
+
+            np.multiply(
+                in_structure,
+                fill_value,
+                out=mask_stack[slab],
+                dtype=mask_stack.dtype,
+            )
+
+        if isinstance(annotation, np.ndarray):
+            block = max(1, MASK_BLOCK_BYTES // annotation[0].nbytes)
+            for start in range(0, mask_stack.shape[0], block):
+                fill_slab(start)
+        else:
+            # Zarr-backed annotation: use slabs of one chunk row, which can be
+            # decoded independently in parallel:
+            block = annotation.chunks[0]
+            _ = self.hemispheres  # load before spawning threads
+            with ThreadPoolExecutor() as executor:
+                list(
+                    executor.map(
+                        fill_slab, range(0, mask_stack.shape[0], block)
+                    )
+                )
 
         return mask_stack
 
 
+def _lookup_numpy(
+    coords,
+    resolution,
+    annotation,
+    hemispheres,
+    ids,
+    ancestors,
+    depths,
+    use_level,
+    level,
+):
+    """Numpy implementation of brainglobe_atlasapi._kernels.lookup, used
+    when numba is not available.
+    """
+    idx = (coords / resolution).astype(np.intp)
+    inside = np.all((idx >= 0) & (idx < annotation.shape), axis=1)
+    idx = tuple(idx[inside].T)
+
+    out_rid = np.zeros(len(coords), dtype=annotation.dtype)
+    out_hem = np.zeros(len(coords), dtype=hemispheres.dtype)
+    out_rid[inside] = annotation[idx]
+    out_hem[inside] = hemispheres[idx]
+
+    if use_level:
+        rows = np.searchsorted(ids, out_rid).clip(max=len(ids) - 1)
+        found = ids[rows] == out_rid
+        # Negative levels are counted from each structure's own depth:
+        cols = depths[rows] + level if level < 0 else np.full_like(rows, level)
+        valid = found & (cols >= 0) & (cols < depths[rows])
+        out_rid = np.where(valid, ancestors[rows, cols.clip(0)], 0).astype(
+            annotation.dtype
+        )
+
+    return out_rid, out_hem
+
+
 class AdditionalRefDict(UserDict):
     """Class implementing the lazy loading of secondary references
     if the dictionary is queried for it.
@@ -357,20 +778,105 @@ class AdditionalRefDict(UserDict):
     def __init__(self, references_list, data_path, *args, **kwargs):
         self.data_path = data_path
         self.references_list = references_list
+        self._references_set = frozenset(references_list)
+
+        # Background threads loading references, see load(block=False),
+        # and the errors raised by the ones that failed:
+        self._loaders = {}
+        self._loader_errors = {}
+        self._loaders_lock = threading.Lock()
 
         super().__init__(*args, **kwargs)
 
+    def __getstate__(self):
+        # Threads and locks cannot be pickled or copied: background reads
+        # still running are not carried over, the copy reads them again.
+        state = self.__dict__.copy()
+        state["data"] = dict(self.data)  # may grow while being pickled
+        for name in ["_loaders", "_loader_errors", "_loaders_lock"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._loaders = {}
+        self._loader_errors = {}
+        self._loaders_lock = threading.Lock()
+
     def __getitem__(self, ref_name):
-        if ref_name not in self.keys():
-            if ref_name not in self.references_list:
-                warnings.warn(
-                    f"No reference named {ref_name} "
-                    f"(available: {self.references_list})"
-                )
-                return None
+        return self.load(ref_name)
+
+    def load(self, ref_name, block=True):
+        """Get a secondary reference, reading it from disk if necessary.
+
+        Parameters
+        ----------
+        ref_name : str
+            Name of the reference.
+        block : bool
+            If False, do not wait for the reference to be read: start
+            reading it in a background thread and return None until it
+            is available. If the background read failed, its error is
+            raised by the next call, and the following one tries again.
+
+        Returns
+        -------
+        np.array or None
+            The reference stack, or None if not (yet) available.
+        """
+        if ref_name in self.data:
+            return self.data[ref_name]
 
-            self.data[ref_name] = read_tiff(
-                self.data_path / f"{ref_name}.tiff"
+        if ref_name not in self._references_set:
+            warnings.warn(
+                f"No reference named {ref_name} "
+                f"(available: {self.references_list})"
             )
+            return None
+
+        with self._loaders_lock:
+            loader = self._loaders.get(ref_name)
+            if loader is not None and not loader.is_alive():
+                # The background read is over, drop it so it can be retried:
+                del self._loaders[ref_name]
+                loader = None
+                error = self._loader_errors.pop(ref_name, None)
+                if error is not None and not block:
+                    raise error
+
+            if ref_name in self.data:
+                return self.data[ref_name]
+
+            if loader is None and not block:
+                loader = threading.Thread(
+                    target=self._read_in_background,
+                    args=(ref_name,),
+                    daemon=True,
+                )
+                self._loaders[ref_name] = loader
+                loader.start()
+
+        if not block:
+            return None
+
+        if loader is not None:
+            loader.join()
+            with self._loaders_lock:
+                self._loaders.pop(ref_name, None)
+                self._loader_errors.pop(ref_name, None)
+
+        # Read in this thread if no background read happened (or it failed),
+        # so that errors are raised to the caller:
+        if ref_name not in self.data:
+            self._read(ref_name)
 
         return self.data[ref_name]
+
+    def _read_in_background(self, ref_name):
+        try:
+            self._read(ref_name)
+        except Exception as error:
+            self._loader_errors[ref_name] = error
+
+    def _read(self, ref_name):
+        self.data[ref_name] = read_tiff(self.data_path / f"{ref_name}.tiff")
@@ -42,6 +42,10 @@ ANNOTATION_FILENAME = "annotation.tiff"
 HEMISPHERES_FILENAME = "hemispheres.tiff"
 MESHES_DIRNAME = "meshes"
 
+# Zarr copies of the atlas stacks, see Atlas(zarr_backend=True):
+ZARR_SUFFIX = ".zarr"
+ZARR_CHUNKS = (64, 64, 64)
+
 # Types for the atlas stacks:
 REFERENCE_DTYPE = np.uint16
 ANNOTATION_DTYPE = np.uint32
@@ -1,3 +1,6 @@
+from collections import defaultdict
+
+import numpy as np
 from treelib import Tree
 
 # TODO evaluate whether we want this as a method in StructureDict
@@ -12,6 +15,58 @@ def child_ids(structure, structure_list):
     ]
 
 
+def get_descendants_map(structures_list):
+    """
+    Maps each structure id to a frozenset with the ids of the structure
+    itself and of all its descendants, with a single bottom-up pass over
+    the hierarchy.
+    """
+    children = defaultdict(list)
+    for s in structures_list:
+        path = s["structure_id_path"]
+        if len(path) >= 2:
+            children[path[-2]].append(s["id"])
+
+    # Deepest structures first, so children are always resolved before
+    # their parents:
+    descendants = {}
+    for s in sorted(
+        structures_list,
+        key=lambda s: len(s["structure_id_path"]),
+        reverse=True,
+    ):
+        sid = s["id"]
+        descendants[sid] = frozenset([sid]).union(
+            *(descendants[c] for c in children[sid])
+        )
+
+    return descendants
+
+
+def get_ancestors_table(structures_list):
+    """
+    Creates a dense table with the structure_id_path of every structure.
+
+    Returns a sorted array with the ids of all structures, a
+    (n_structures, max_depth) array where row i holds the ancestors of
+    ids[i] (the structure itself included), padded with 0 past its depth,
+    and an array with the depth (path length) of every row.
+    Rows for a given id can be found with np.searchsorted(ids, id).
+    """
+    ids = np.array(sorted(s["id"] for s in structures_list), dtype=np.int64)
+    max_depth = max(len(s["structure_id_path"]) for s in structures_list)
+
+    ancestors = np.zeros((len(ids), max_depth), dtype=np.int64)
+    depths = np.zeros(len(ids), dtype=np.int64)
+    for s in structures_list:
+        path = s["structure_id_path"]
+        row = np.searchsorted(ids, s["id"])
+        ancestors[row, : len(path)] = path
+        depths[row] = len(path)
+
+    return ids, ancestors, depths
+
+
 def get_structures_tree(structures_list):
     """
     Creates a 'tree' graph with the hierarchical organisation of all
@@ -22,7 +22,10 @@ def update_atlas(atlas_name, force=False):
         and doesn't update if that's the case.
     """
 
-    atlas = BrainGlobeAtlas(atlas_name=atlas_name, check_latest=False)
+    # No prefetching, as the atlas folder may be deleted right away:
+    atlas = BrainGlobeAtlas(
+        atlas_name=atlas_name, check_latest=False, prefetch=False
+    )
 
     # Check if we need to update
     if not force:
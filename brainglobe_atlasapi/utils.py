@@ -2,8 +2,12 @@ import configparser
 import json
 import logging
 import re
+import shutil
+import tempfile
+from pathlib import Path
 from typing import Callable, Optional
 
+import numpy as np
 import requests
 import tifffile
 from rich.panel import Panel
@@ -319,6 +323,73 @@ def read_tiff(path):
     return tifffile.imread(str(path))
 
 
+def memmap_tiff(path):
+    """Open a tiff file as a read-only memory-mapped array, so that only the
+    parts of the stack that are accessed are read from disk. Falls back to
+    reading the whole file if the tiff is not memory-mappable (e.g. if
+    it is compressed).
+
+    Parameters
+    ----------
+    path : str or Path object
+
+    Returns
+    -------
+    np.array
+        Numpy stack from the tiff, viewing the memory map if possible.
+
+    """
+    try:
+        # Plain ndarray view of the map, as np.memmap indexing is slower:
+        return tifffile.memmap(str(path), mode="r").view(np.ndarray)
+    except ValueError:
+        return read_tiff(path)
+
+
+def tiff_to_zarr(tiff_path, zarr_path, chunks):
+    """Transcode a tiff stack to a chunked zarr array on disk. The array is
+    written to a unique temporary folder next to zarr_path first, so that
+    an interrupted conversion never leaves a partial array at zarr_path and
+    concurrent conversions of the same stack do not interfere.
+
+    Parameters
+    ----------
+    tiff_path : str or Path object
+    zarr_path : str or Path object
+    chunks : tuple
+        Chunk shape of the zarr array.
+
+    """
+    import zarr
+
+    zarr_path = Path(zarr_path)
+    stack = read_tiff(tiff_path)
+
+    tmp_path = Path(
+        tempfile.mkdtemp(dir=zarr_path.parent, prefix=zarr_path.name)
+    )
+    try:
+        array = zarr.open_array(
+            str(tmp_path),
+            mode="w",
+            shape=stack.shape,
+            chunks=tuple(min(c, s) for c, s in zip(chunks, stack.shape)),
+            dtype=stack.dtype,
+        )
+        array[:] = stack
+
+        # Another process may have completed the same conversion meanwhile:
+        if not zarr_path.exists():
+            try:
+                tmp_path.rename(zarr_path)
+            except OSError:
+                if not zarr_path.exists():
+                    raise
+    finally:
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+
+
 def get_leaves_from_tree(structures_list):
     """Parse a structure tree (in list format) to find leaf nodes
 
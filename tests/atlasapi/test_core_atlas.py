@@ -1,4 +1,8 @@
 import contextlib
+import copy
+import json
+import pickle
+import shutil
 from io import StringIO
 
 import numpy as np
@@ -7,6 +11,7 @@ import pytest
 import tifffile
 
 import brainglobe_atlasapi.core as core
+from brainglobe_atlasapi import descriptors, utils
 from brainglobe_atlasapi.core import AdditionalRefDict
 
 
@@ -54,6 +59,59 @@ def test_additional_ref_dict(temp_path):
         assert add_ref_dict["3"] is None
 
 
+def test_additional_ref_dict_non_blocking(temp_path):
+    stack = np.ones((10, 20, 30))
+    tifffile.imwrite(temp_path / "1.tiff", stack)
+
+    add_ref_dict = AdditionalRefDict(["1"], temp_path)
+
+    loaded = add_ref_dict.load("1", block=False)
+    assert loaded is None or np.array_equal(loaded, stack)
+
+    add_ref_dict._loaders["1"].join()
+    assert np.array_equal(add_ref_dict.load("1", block=False), stack)
+    assert np.array_equal(add_ref_dict["1"], stack)
+
+
+def test_additional_ref_dict_non_blocking_failure(temp_path):
+    add_ref_dict = AdditionalRefDict(["1"], temp_path)
+
+    # The background read fails as the file does not exist yet:
+    assert add_ref_dict.load("1", block=False) is None
+    add_ref_dict._loaders["1"].join()
+    with pytest.raises(FileNotFoundError):
+        add_ref_dict.load("1", block=False)
+
+    # Once the error is reported, the next call tries again:
+    stack = np.ones((10, 20, 30))
+    tifffile.imwrite(temp_path / "1.tiff", stack)
+
+    loaded = add_ref_dict.load("1", block=False)
+    assert loaded is None or np.array_equal(loaded, stack)
+    if "1" in add_ref_dict._loaders:
+        add_ref_dict._loaders["1"].join()
+    assert np.array_equal(add_ref_dict.load("1", block=False), stack)
+
+
+def test_additional_ref_dict_pickle(temp_path):
+    stack = np.ones((10, 20, 30))
+    for k in ["1", "2"]:
+        tifffile.imwrite(temp_path / f"{k}.tiff", stack)
+
+    add_ref_dict = AdditionalRefDict(["1", "2"], temp_path)
+    assert np.array_equal(add_ref_dict["1"], stack)
+    add_ref_dict.load("2", block=False)
+
+    for copied in [
+        pickle.loads(pickle.dumps(add_ref_dict)),
+        copy.deepcopy(add_ref_dict),
+    ]:
+        assert np.array_equal(copied.data["1"], stack)
+        assert copied._loaders == {}
+        assert np.array_equal(copied["2"], stack)
+        assert np.array_equal(copied.load("2", block=False), stack)
+
+
 @pytest.mark.parametrize(
     "stack_name, val",
     [
@@ -67,6 +125,116 @@ def test_stacks(atlas, stack_name, val):
     assert np.allclose(loaded_stack[65:67, 39:41, 57:59], val)
 
 
+def test_prefetch(atlas):
+    atlas._prefetch_thread.join()
+    assert atlas._annotation is not None
+    assert atlas._reference is not None
+
+    no_prefetch = core.Atlas(atlas.root_dir, prefetch=False)
+    assert no_prefetch._prefetch_thread is None
+    assert no_prefetch._annotation is None
+    assert np.array_equal(no_prefetch.annotation, atlas.annotation)
+
+
+def test_prefetch_zarr_backend(atlas, temp_path):
+    pytest.importorskip("zarr")
+    atlas_dir = temp_path / "atlas"
+    shutil.copytree(atlas.root_dir, atlas_dir)
+
+    # Missing zarr copies are not created by the prefetching thread:
+    zarr_atlas = core.Atlas(atlas_dir, zarr_backend=True)
+    zarr_atlas._prefetch_thread.join()
+    assert zarr_atlas._annotation is None
+    assert zarr_atlas._reference is None
+    assert not list(atlas_dir.glob(f"*{descriptors.ZARR_SUFFIX}*"))
+
+    # Existing ones are opened:
+    annotation_path = atlas_dir / descriptors.ANNOTATION_FILENAME
+    utils.tiff_to_zarr(
+        annotation_path,
+        annotation_path.with_suffix(descriptors.ZARR_SUFFIX),
+        chunks=descriptors.ZARR_CHUNKS,
+    )
+    zarr_atlas = core.Atlas(atlas_dir, zarr_backend=True)
+    zarr_atlas._prefetch_thread.join()
+    assert zarr_atlas._annotation is not None
+    assert zarr_atlas._reference is None
+
+
+@pytest.mark.parametrize("copy_atlas", [pickle.dumps, copy.deepcopy])
+def test_pickle(atlas, copy_atlas):
+    copied = copy_atlas(atlas)
+    if copy_atlas is pickle.dumps:
+        copied = pickle.loads(copied)
+
+    assert copied._prefetch_thread is None
+    assert np.array_equal(copied.annotation, atlas.annotation)
+    assert np.array_equal(copied.reference, atlas.reference)
+    assert copied.structure_from_coords(
+        (39, 36, 57), as_acronym=True
+    ) == atlas.structure_from_coords((39, 36, 57), as_acronym=True)
+
+
+def test_zarr_backend(atlas, temp_path):
+    pytest.importorskip("zarr")
+    atlas_dir = temp_path / "atlas"
+    shutil.copytree(atlas.root_dir, atlas_dir)
+
+    # Store hemispheres explicitly, so that they are read from zarr too:
+    tifffile.imwrite(
+        atlas_dir / descriptors.HEMISPHERES_FILENAME, atlas.hemispheres
+    )
+    metadata = utils.read_json(atlas_dir / descriptors.METADATA_FILENAME)
+    metadata["symmetric"] = False
+    with open(atlas_dir / descriptors.METADATA_FILENAME, "w") as f:
+        json.dump(metadata, f)
+
+    # Small chunks, so that masks are built from several slabs:
+    for filename in [
+        descriptors.ANNOTATION_FILENAME,
+        descriptors.HEMISPHERES_FILENAME,
+    ]:
+        tiff_path = atlas_dir / filename
+        utils.tiff_to_zarr(
+            tiff_path,
+            tiff_path.with_suffix(descriptors.ZARR_SUFFIX),
+            chunks=(16, 32, 32),
+        )
+
+    # Zarr copies are only used on request:
+    assert isinstance(core.Atlas(atlas_dir).annotation, np.ndarray)
+
+    zarr_atlas = core.Atlas(atlas_dir, zarr_backend=True, prefetch=False)
+    assert not isinstance(zarr_atlas.annotation, np.ndarray)
+    assert not isinstance(zarr_atlas.hemispheres, np.ndarray)
+    assert zarr_atlas.annotation.chunks[0] < zarr_atlas.shape[0]
+
+    for hemisphere in [-1, 0, 1]:
+        assert np.array_equal(
+            zarr_atlas.get_structure_mask("root", hemisphere=hemisphere),
+            atlas.get_structure_mask("root", hemisphere=hemisphere),
+        )
+
+    for coords in [(39, 36, 57), (70, 40, 80), (1, 1, 1)]:
+        rid = zarr_atlas.structure_from_coords(coords)
+        assert not isinstance(rid, np.ndarray)
+        assert rid == atlas.structure_from_coords(coords)
+        assert zarr_atlas.structure_from_coords(
+            coords, as_acronym=True
+        ) == atlas.structure_from_coords(coords, as_acronym=True)
+
+        hem = zarr_atlas.hemisphere_from_coords(coords)
+        assert not isinstance(hem, np.ndarray)
+        assert hem == atlas.hemisphere_from_coords(coords)
+        assert zarr_atlas.hemisphere_from_coords(
+            coords, as_string=True
+        ) == atlas.hemisphere_from_coords(coords, as_string=True)
+
+    assert zarr_atlas.structure_from_coords(
+        (39, 36, 57), hierarchy_lev=0
+    ) == atlas.structure_from_coords((39, 36, 57), hierarchy_lev=0)
+
+
 def test_structures(atlas):
     assert {s["acronym"]: k for k, s in atlas.structures.items()} == {
         "root": 997,
@@ -122,6 +290,55 @@ def test_data_from_coords_out_of_brain(
     )
 
 
+def test_data_from_coords_batch(atlas):
+    coords = np.array([[39, 36, 57], [1, 1, 1]])
+    res = atlas.resolution
+
+    assert np.array_equal(
+        atlas.structure_from_coords_batch(coords),
+        [atlas.structure_from_coords(c) for c in coords],
+    )
+    assert list(
+        atlas.structure_from_coords_batch(coords, as_acronym=True)
+    ) == ["root", "Outside atlas"]
+    assert list(
+        atlas.structure_from_coords_batch(
+            coords * np.array(res), microns=True, as_acronym=True
+        )
+    ) == ["root", "Outside atlas"]
+    assert list(
+        atlas.hemisphere_from_coords_batch(coords, as_string=True)
+    ) == [atlas.hemisphere_from_coords(c, as_string=True) for c in coords]
+
+
+def test_structure_and_hemisphere_from_coords_batch(atlas):
+    coords = np.array([[39, 36, 57], [1, 1, 1], [-1, 36, 57]])
+
+    rids, hems = atlas.structure_and_hemisphere_from_coords_batch(coords)
+    assert list(rids) == [997, 0, 0]
+    assert list(hems) == [core.RIGHT_HEMI_VAL, core.RIGHT_HEMI_VAL, 0]
+
+    rids, _ = atlas.structure_and_hemisphere_from_coords_batch(
+        coords * np.array(atlas.resolution), microns=True, hierarchy_lev=0
+    )
+    assert list(rids) == [997, 0, 0]
+
+    rids, _ = atlas.structure_and_hemisphere_from_coords_batch(
+        coords, hierarchy_lev=-1
+    )
+    assert list(rids) == [
+        atlas.structure_from_coords((39, 36, 57), hierarchy_lev=-1),
+        0,
+        0,
+    ]
+
+    for hierarchy_lev in [10, -10]:
+        with pytest.raises(ValueError):
+            atlas.structure_and_hemisphere_from_coords_batch(
+                coords, hierarchy_lev=hierarchy_lev
+            )
+
+
 def test_meshfile_from_id(atlas):
     assert (
         atlas.meshfile_from_structure("CH")
@@ -152,6 +369,8 @@ def test_lookup_df(atlas):
     )
 
     assert all(df_lookup == df)
+    assert df_lookup["acronym"].dtype == "string[pyarrow]"
+    assert df_lookup["name"].dtype == "string[pyarrow]"
 
 
 def test_hierarchy(atlas):
@@ -183,6 +402,30 @@ def test_mask(atlas):
 
     assert np.sum(mask > 0) == 3589
     assert np.sum((mask > 0) & (mask_left > 0)) == 1709
+    assert mask.dtype == np.uint8
+    assert set(np.unique(mask)) == {0, 1}
+
+    mask_id = atlas.get_structure_mask(
+        "grey", dtype=atlas.annotation.dtype, fill_value=8
+    )
+    assert mask_id.dtype == atlas.annotation.dtype
+    assert set(np.unique(mask_id)) <= {0, 8}
+
+
+@pytest.mark.parametrize("dtype", [None, np.uint16, np.int64, np.uint64])
+@pytest.mark.parametrize("lut_max_size", [2**24, 1])
+def test_mask_matches_isin(atlas, monkeypatch, lut_max_size, dtype):
+    # A max size of 1 forces the binary-search path:
+    monkeypatch.setattr(core, "MASK_LUT_MAX_SIZE", lut_max_size)
+    if dtype is not None:
+        atlas._annotation = atlas.annotation.astype(dtype)
+
+    for structure in ["root", "grey", "CH"]:
+        descendant_ids = list(atlas._get_descendant_ids(structure))
+        mask = atlas.get_structure_mask(structure)
+        assert np.array_equal(
+            mask.astype(bool), np.isin(atlas.annotation, descendant_ids)
+        )
 
 
 def test_leaf(atlas):
@@ -3,6 +3,7 @@ import pytest
 
 from brainglobe_atlasapi import descriptors
 from brainglobe_atlasapi.structure_class import StructuresDict
+from brainglobe_atlasapi.structure_tree_util import get_descendants_map
 from brainglobe_atlasapi.utils import read_json
 
 structures_list = [
@@ -63,3 +64,12 @@ def test_mesh_loading(atlas_path):
 
     struct_dict = StructuresDict(structures_list_real)
     assert isinstance(struct_dict["997"]["mesh"], mio.Mesh)
+
+
+def test_descendants_map():
+    descendants = get_descendants_map(structures_list)
+    assert descendants == {
+        997: {997, 8, 567},
+        8: {8, 567},
+        567: {567},
+    }
@@ -1,7 +1,9 @@
 from unittest import mock
 
+import numpy as np
 import pytest
 import requests
+import tifffile
 from requests import HTTPError
 
 from brainglobe_atlasapi import utils
@@ -92,3 +94,49 @@ def test_get_leaves():
     leaf_nodes = utils.get_leaves_from_tree(structures_list)
 
     assert leaf_nodes == [8]
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_memmap_tiff(temp_path, compression):
+    stack = np.arange(120, dtype=np.uint16).reshape(4, 5, 6)
+    tifffile.imwrite(
+        temp_path / "stack.tiff",
+        stack,
+        photometric="minisblack",
+        compression=compression,
+    )
+
+    loaded = utils.memmap_tiff(temp_path / "stack.tiff")
+
+    assert type(loaded) is np.ndarray
+    assert isinstance(loaded.base, np.memmap) == (compression is None)
+    if compression is None:
+        assert not loaded.flags.writeable
+    assert np.array_equal(loaded, stack)
+
+
+def test_tiff_to_zarr(temp_path):
+    zarr = pytest.importorskip("zarr")
+    stack = np.arange(120, dtype=np.uint16).reshape(4, 5, 6)
+    tifffile.imwrite(temp_path / "stack.tiff", stack, photometric="minisblack")
+
+    utils.tiff_to_zarr(
+        temp_path / "stack.tiff", temp_path / "stack.zarr", chunks=(2, 64, 64)
+    )
+
+    loaded = zarr.open_array(str(temp_path / "stack.zarr"), mode="r")
+    assert loaded.chunks == (2, 5, 6)
+    assert np.array_equal(loaded[:], stack)
+
+    # Converting again when the target exists (e.g. written meanwhile by
+    # another process) keeps it and discards the temporary copy:
+    utils.tiff_to_zarr(
+        temp_path / "stack.tiff", temp_path / "stack.zarr", chunks=(4, 4, 4)
+    )
+
+    loaded = zarr.open_array(str(temp_path / "stack.zarr"), mode="r")
+    assert loaded.chunks == (2, 5, 6)
+    assert sorted(p.name for p in temp_path.iterdir()) == [
+        "stack.tiff",
+        "stack.zarr",
+    ]
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from brainglobe_atlasapi.atlas_generation.volume_utils import (
+    create_masked_array,
+)
+
+
+@pytest.mark.parametrize(
+    "dtype, label",
+    [
+        (np.uint8, [3, 44]),
+        # 300 wraps to 44 in uint8, which must not be matched:
+        (np.uint8, [3, 300]),
+        (np.uint16, [3, 300, 70000]),
+    ],
+)
+def test_create_masked_array_label_list(dtype, label):
+    volume = np.arange(4 * 5 * 6).reshape(4, 5, 6).astype(dtype) % 50
+    volume[0, 0, :] = 44
+
+    expected = np.zeros_like(volume)
+    expected[np.isin(volume, label)] = 1
+
+    masked = create_masked_array(volume, label)
+
+    assert masked.dtype == volume.dtype
+    assert np.array_equal(masked, expected)